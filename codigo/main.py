@@ -1,6 +1,6 @@
 import os
 import subprocess
-from PIL import Image
+from PIL import Image, ImageOps
 from pillow_heif import register_heif_opener
 import shutil
 import concurrent.futures
@@ -9,6 +9,13 @@ import time
 import sys
 import datetime
 import re
+import io
+import codecs
+import locale
+import threading
+import tempfile
+import functools
+from collections import deque
 
 register_heif_opener()
 
@@ -57,6 +64,20 @@ MAX_RETRIES_FILE_OPS = 15
 RETRY_DELAY_FILE_OPS = 0.5
 DEBUG_MODE = True
 DEVELOPER_MODE = False
+# Salidas adicionales (miniaturas, previas) generadas desde la misma decodificación
+# Cada entrada: {"formato": "JPEG", "tamano_max": 320, "calidad": 80, "carpeta": ruta_absoluta}
+EXTRA_OUTPUT_SPECS = []
+EXTRA_OUTPUT_FORMATS = {"JPEG": ".jpg", "JPG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+# Verificación del archivo convertido antes de borrar el original
+VERIFY_OUTPUTS = True
+VERIFY_SAMPLED_DECODE = False
+# Copia local opcional (disco rápido o tmpfs) para orígenes/destinos lentos o en red
+SCRATCH_DIRECTORY = None
+SCRATCH_READ_AHEAD_PER_WORKER = 2
+SCRATCH_READ_CONCURRENCY = 2
+SCRATCH_WRITE_CONCURRENCY = 1
+SCRATCH_READ_LIMIT_MBPS = 0
+SCRATCH_WRITE_LIMIT_MBPS = 0
 
 def clear_console():
     if os.name == 'nt':
@@ -64,8 +85,73 @@ def clear_console():
     else:
         os.system('clear')
 
+def is_path_inside(path, directory):
+    path = os.path.normcase(os.path.abspath(path))
+    directory = os.path.normcase(os.path.abspath(directory))
+    try:
+        return os.path.commonpath([path, directory]) == directory
+    except ValueError:
+        # Rutas en unidades distintas (Windows)
+        return False
+
+# Interpreta 'salidas-extra = JPEG:320:80:miniaturas; WEBP:1600:75:previas'
+# (formato:tamaño_máximo_en_px:calidad:carpeta_destino, separadas por ';'; la carpeta puede ser absoluta)
+def parse_extra_output_specs(value):
+    specs = []
+    for raw_spec in value.split(';'):
+        raw_spec = raw_spec.strip()
+        if not raw_spec:
+            continue
+        parts = [part.strip() for part in raw_spec.split(':', 3)]
+        if len(parts) != 4:
+            print(f"⚠️ Salida extra ignorada (formato esperado FORMATO:TAMAÑO:CALIDAD:CARPETA): '{raw_spec}'")
+            continue
+        output_format, max_size, quality, folder = parts
+        output_format = output_format.upper()
+        if output_format not in EXTRA_OUTPUT_FORMATS:
+            print(f"⚠️ Salida extra ignorada: formato '{output_format}' no soportado ({', '.join(EXTRA_OUTPUT_FORMATS)}).")
+            continue
+        try:
+            max_size = int(max_size)
+            quality = int(quality)
+        except ValueError:
+            print(f"⚠️ Salida extra ignorada: tamaño o calidad no numéricos en '{raw_spec}'.")
+            continue
+        if output_format == "JPG":
+            output_format = "JPEG"
+        folder = os.path.abspath(os.path.join(BASE_DIRECTORY, folder))
+        # En la propia carpeta de salida se mezclarían con el archivo comprimido (y con su tamaño)
+        if os.path.normcase(folder) == os.path.normcase(os.path.abspath(OUTPUT_DIRECTORY)):
+            print(f"⚠️ Salida extra ignorada: la carpeta '{folder}' es la carpeta de salida. Usa una subcarpeta u otra ruta.")
+            continue
+        # Dentro de la carpeta de entrada, la siguiente ejecución las trataría como fotos nuevas
+        if is_path_inside(folder, SOURCE_DIRECTORY):
+            print(f"⚠️ Salida extra ignorada: la carpeta '{folder}' está dentro de la carpeta de entrada ({SOURCE_DIRECTORY}).")
+            continue
+        if any(spec["formato"] == output_format and os.path.normcase(spec["carpeta"]) == os.path.normcase(folder) for spec in specs):
+            print(f"⚠️ Salida extra ignorada: ya hay una salida {output_format} en '{folder}'.")
+            continue
+        specs.append({
+            "formato": output_format,
+            "tamano_max": max_size,
+            "calidad": quality,
+            "carpeta": folder,
+        })
+    return specs
+
+def _config_number(config_values, key, default):
+    value = config_values.get(key)
+    if not value:
+        return default
+    try:
+        return float(value) if '.' in value else int(value)
+    except ValueError:
+        print(f"⚠️ Valor no numérico para '{key}' ({value}). Se usa {default}.")
+        return default
+
 def load_configuration():
-    global SOURCE_DIRECTORY, OUTPUT_DIRECTORY, DEVELOPER_MODE
+    global SOURCE_DIRECTORY, OUTPUT_DIRECTORY, DEVELOPER_MODE, EXTRA_OUTPUT_SPECS, VERIFY_OUTPUTS, VERIFY_SAMPLED_DECODE
+    global SCRATCH_DIRECTORY, SCRATCH_READ_CONCURRENCY, SCRATCH_WRITE_CONCURRENCY, SCRATCH_READ_LIMIT_MBPS, SCRATCH_WRITE_LIMIT_MBPS
     config_path = os.path.join(BASE_DIRECTORY, "extra", "config.txt")
     default_source_subdir = "entrada"
     default_output_subdir = "salida"
@@ -80,6 +166,17 @@ def load_configuration():
                 f.write(f"carpeta_entrada = {default_source_subdir}\n")
                 f.write(f"carpeta_salida = {default_output_subdir}\n")
                 f.write("modo-desarrollador = NO\n")
+                f.write("# Miniaturas/previas opcionales: FORMATO:TAMAÑO:CALIDAD:CARPETA separadas por ';'\n")
+                f.write("# salidas-extra = JPEG:320:80:miniaturas; WEBP:1600:75:previas\n")
+                f.write("# Verificación antes de borrar originales (estructura siempre; decodificación de muestra opcional)\n")
+                f.write("# verificacion = SI\n")
+                f.write("# verificacion-decodificada = NO\n")
+                f.write("# Carpeta local rápida para trabajar con carpetas en red (límites en MB/s, 0 = sin límite)\n")
+                f.write("# carpeta-temporal = C:\\temp\\neu\n")
+                f.write("# copias-lectura-simultaneas = 2\n")
+                f.write("# copias-escritura-simultaneas = 1\n")
+                f.write("# limite-lectura-mb = 0\n")
+                f.write("# limite-escritura-mb = 0\n")
         except Exception as e:
             print(f"❌ Error al crear el archivo de configuración '{config_path}': {e}")
 
@@ -99,7 +196,8 @@ def load_configuration():
             print(f"❌ Error al leer el archivo de configuración '{config_path}'. Se usarán las rutas por defecto.")
 
     # Ajusta rutas según configuración
-    global SOURCE_DIRECTORY, OUTPUT_DIRECTORY, DEVELOPER_MODE
+    global SOURCE_DIRECTORY, OUTPUT_DIRECTORY, DEVELOPER_MODE, EXTRA_OUTPUT_SPECS, VERIFY_OUTPUTS, VERIFY_SAMPLED_DECODE
+    global SCRATCH_DIRECTORY, SCRATCH_READ_CONCURRENCY, SCRATCH_WRITE_CONCURRENCY, SCRATCH_READ_LIMIT_MBPS, SCRATCH_WRITE_LIMIT_MBPS
     if config_values.get("modo-desarrollador", "").upper() == "SI":
         SOURCE_DIRECTORY = os.path.join(BASE_DIRECTORY, "extra", "archivos-ejemplo")
         DEVELOPER_MODE = True
@@ -115,6 +213,19 @@ def load_configuration():
         else:
             OUTPUT_DIRECTORY = os.path.join(BASE_DIRECTORY, default_output_subdir)
 
+    if config_values.get("salidas-extra"):
+        EXTRA_OUTPUT_SPECS = parse_extra_output_specs(config_values["salidas-extra"])
+    if config_values.get("verificacion", "").upper() == "NO":
+        VERIFY_OUTPUTS = False
+    if config_values.get("verificacion-decodificada", "").upper() == "SI":
+        VERIFY_SAMPLED_DECODE = True
+    if config_values.get("carpeta-temporal"):
+        SCRATCH_DIRECTORY = os.path.abspath(os.path.join(BASE_DIRECTORY, config_values["carpeta-temporal"]))
+        SCRATCH_READ_CONCURRENCY = max(1, int(_config_number(config_values, "copias-lectura-simultaneas", SCRATCH_READ_CONCURRENCY)))
+        SCRATCH_WRITE_CONCURRENCY = max(1, int(_config_number(config_values, "copias-escritura-simultaneas", SCRATCH_WRITE_CONCURRENCY)))
+        SCRATCH_READ_LIMIT_MBPS = max(0, _config_number(config_values, "limite-lectura-mb", SCRATCH_READ_LIMIT_MBPS))
+        SCRATCH_WRITE_LIMIT_MBPS = max(0, _config_number(config_values, "limite-escritura-mb", SCRATCH_WRITE_LIMIT_MBPS))
+
     # No crear carpetas automáticamente
 
 load_configuration()
@@ -123,9 +234,17 @@ EXTERNAL_TOOLS_DIRECTORY = os.path.join(BASE_DIRECTORY, "extra")
 LOG_FILENAME = os.path.join(BASE_DIRECTORY, "extra", "logs.txt")
 IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.gif', '.heic', '.heif')
 VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm', '.flv')
+# Progreso en vivo de HandBrakeCLI: "Encoding: task 1 of 1, 45.67 % (120.50 fps, avg 118.20 fps, ETA 00h01m23s)"
+HANDBRAKE_PROGRESS_PATTERN = re.compile(r"Encoding: task (\d+) of (\d+), ([\d.]+) %(?: \(([\d.]+) fps, avg ([\d.]+) fps, ETA (\d+)h(\d+)m(\d+)s\))?")
+HANDBRAKE_OUTPUT_TAIL_LINES = 200
+PROGRESS_REFRESH_SECONDS = 0.5
+video_progress = {}
+video_progress_lock = threading.Lock()
 original_stdout = sys.stdout
 original_stderr = sys.stderr
 log_file_handle = None
+# Ruta de ffmpeg (opcional), resuelta una sola vez al arrancar en process_gallery
+FFMPEG_PATH = None
 
 class CustomStream:
     def __init__(self, terminal_stream, file_stream):
@@ -186,7 +305,69 @@ def check_binary_exists_in_path_or_dir(binary_name, specific_dir=None):
         return path_result
     return False
 
-def convert_image_to_heic(input_path, output_path, quality, original_exif=None):
+# Rutas de las salidas extra para un archivo, respetando la estructura de subcarpetas de entrada
+def get_extra_output_paths(relative_path, name):
+    extra_outputs = []
+    for spec in EXTRA_OUTPUT_SPECS:
+        extra_subdir = os.path.join(spec["carpeta"], os.path.dirname(relative_path))
+        os.makedirs(extra_subdir, exist_ok=True)
+        extra_path = os.path.join(extra_subdir, f"{name}{EXTRA_OUTPUT_FORMATS[spec['formato']]}")
+        extra_outputs.append((spec, extra_path))
+    return extra_outputs
+
+# Genera miniaturas/previas a partir de una imagen ya decodificada (sin volver a leer el original)
+# EXIF mínimo para miniaturas/previas web: fechas y cámara, sin GPS, sin miniatura embebida y sin orientación
+# (la imagen ya se gira antes de reducirla)
+WEB_EXIF_KEPT_TAGS = (0x010F, 0x0110, 0x0132)  # Make, Model, DateTime
+WEB_EXIF_KEPT_EXIF_IFD_TAGS = (0x9003, 0x9004, 0x9010, 0x9011)  # DateTimeOriginal, DateTimeDigitized, OffsetTime, OffsetTimeOriginal
+
+def _reduced_web_exif(original_exif):
+    try:
+        source_exif = Image.Exif()
+        source_exif.load(original_exif)
+        reduced_exif = Image.Exif()
+        for tag in WEB_EXIF_KEPT_TAGS:
+            if tag in source_exif:
+                reduced_exif[tag] = source_exif[tag]
+        source_exif_ifd = source_exif.get_ifd(0x8769)
+        kept_exif_ifd = {tag: source_exif_ifd[tag] for tag in WEB_EXIF_KEPT_EXIF_IFD_TAGS if tag in source_exif_ifd}
+        if kept_exif_ifd:
+            reduced_exif.get_ifd(0x8769).update(kept_exif_ifd)
+        return reduced_exif.tobytes() if len(reduced_exif) else None
+    except Exception as e:
+        _debug_print(f"No se pudo reducir el EXIF para las salidas extra: {e}")
+        return None
+
+def save_extra_outputs(img, extra_outputs, original_exif=None):
+    written_outputs = []
+    # Se aplica la orientación EXIF una sola vez: PNG no guarda EXIF y no todos los visores lo respetan
+    try:
+        base_img = ImageOps.exif_transpose(img)
+    except Exception as e:
+        _debug_print(f"No se pudo aplicar la orientación EXIF para las salidas extra: {e}")
+        base_img = img
+    web_exif = _reduced_web_exif(original_exif) if original_exif else None
+    # De mayor a menor: cada salida se reduce desde la anterior, que ya es más pequeña que el original
+    for spec, extra_path in sorted(extra_outputs, key=lambda item: item[0]["tamano_max"], reverse=True):
+        try:
+            extra_img = base_img.copy()
+            extra_img.thumbnail((spec["tamano_max"], spec["tamano_max"]), Image.LANCZOS)
+            base_img = extra_img
+            if spec["formato"] == "JPEG" and extra_img.mode != 'RGB':
+                extra_img = extra_img.convert('RGB')
+            save_options = {"format": spec["formato"]}
+            if spec["formato"] in ("JPEG", "WEBP"):
+                save_options["quality"] = spec["calidad"]
+                if web_exif:
+                    save_options["exif"] = web_exif
+            extra_img.save(extra_path, **save_options)
+            written_outputs.append((extra_path, os.path.getsize(extra_path)))
+            _debug_print(f"Salida extra {os.path.basename(extra_path)} ({spec['formato']}, {spec['tamano_max']}px) guardada.")
+        except Exception as e:
+            print(f"\n     ⚠️ No se pudo generar la salida extra {extra_path}: {e}")
+    return written_outputs
+
+def convert_image_to_heic(input_path, output_path, quality, original_exif=None, extra_outputs=None):
     _debug_print(f"Convirtiendo imagen: {os.path.basename(input_path)} a {os.path.basename(output_path)}")
     try:
         img = Image.open(input_path)
@@ -197,12 +378,44 @@ def convert_image_to_heic(input_path, output_path, quality, original_exif=None):
 
         img.save(output_path, format="HEIF", quality=quality, exif=original_exif)
         _debug_print(f"Imagen {os.path.basename(input_path)} guardada exitosamente.")
-        return True
+        written_outputs = []
+        if extra_outputs:
+            written_outputs = save_extra_outputs(img, extra_outputs, original_exif)
+        img.close()
+        return True, written_outputs
     except Exception as e:
         print(f"\n     ❌ Error al convertir imagen {os.path.basename(input_path)}: {e}")
-        return False
+        return False, []
+
+# Extrae un fotograma del video para las salidas extra (poster). Usa ffmpeg si está disponible.
+def extract_video_poster_frame(input_path):
+    if not FFMPEG_PATH:
+        return None
 
-def convert_video_to_hevc(input_path, output_path, crf, preset, enable_gpu, gpu_encoder):
+    creation_flags = 0
+    if platform.system() == "Windows":
+        creation_flags = subprocess.CREATE_NO_WINDOW
+
+    # Primero a 1 segundo (evita fotogramas negros iniciales); si el video es más corto, el primero
+    for seek_seconds in ("1", "0"):
+        command = [FFMPEG_PATH, "-v", "error", "-ss", seek_seconds, "-i", input_path, "-frames:v", "1", "-f", "image2pipe", "-vcodec", "png", "-"]
+        try:
+            result = subprocess.run(command, capture_output=True, check=False, creationflags=creation_flags)
+        except Exception as e:
+            _debug_print(f"Error al extraer fotograma de {os.path.basename(input_path)}: {e}")
+            return None
+        if result.returncode == 0 and result.stdout:
+            try:
+                poster = Image.open(io.BytesIO(result.stdout))
+                poster.load()
+                return poster
+            except Exception as e:
+                _debug_print(f"Fotograma de {os.path.basename(input_path)} no válido: {e}")
+                return None
+    _debug_print(f"ffmpeg no devolvió ningún fotograma para {os.path.basename(input_path)}.")
+    return None
+
+def convert_video_to_hevc(input_path, output_path, crf, preset, enable_gpu, gpu_encoder, progress_key=None):
     encoder_option = "x265"
 
     if enable_gpu and gpu_encoder:
@@ -236,22 +449,34 @@ def convert_video_to_hevc(input_path, output_path, crf, preset, enable_gpu, gpu_
     _debug_print(f"Intentando convertir video: {os.path.basename(input_path)}")
     _debug_print(f"Comando HandBrakeCLI: {' '.join(command)}")
 
+    process = None
     try:
-        result = subprocess.run(command, capture_output=True, text=True, check=False, creationflags=creation_flags)
-
-        _debug_print(f"HandBrakeCLI STDOUT para {os.path.basename(input_path)}:\n{result.stdout.strip()}")
-        _debug_print(f"HandBrakeCLI STDERR para {os.path.basename(input_path)}:\n{result.stderr.strip()}")
-
-        if result.returncode == 0:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=creation_flags)
+
+        # Solo se guardan las últimas líneas de cada salida para el diagnóstico de errores
+        stdout_tail = deque(maxlen=HANDBRAKE_OUTPUT_TAIL_LINES)
+        stderr_tail = deque(maxlen=HANDBRAKE_OUTPUT_TAIL_LINES)
+        stderr_thread = threading.Thread(target=_read_stream_tail, args=(process.stderr, stderr_tail), daemon=True)
+        stderr_thread.start()
+        _read_handbrake_progress(process.stdout, stdout_tail, progress_key or input_path)
+        returncode = process.wait()
+        stderr_thread.join()
+
+        stdout_text = "\n".join(stdout_tail)
+        stderr_text = "\n".join(stderr_tail)
+        _debug_print(f"HandBrakeCLI STDOUT (últimas líneas) para {os.path.basename(input_path)}:\n{stdout_text}")
+        _debug_print(f"HandBrakeCLI STDERR (últimas líneas) para {os.path.basename(input_path)}:\n{stderr_text}")
+
+        if returncode == 0:
             return True
         else:
-            if result.stderr:
-                print(f"         STDERR de HandBrakeCLI:\n{result.stderr.strip()}")
-                if "No such file or directory" in result.stderr or "Unable to open input file" in result.stderr:
+            if stderr_text:
+                print(f"         STDERR de HandBrakeCLI:\n{stderr_text}")
+                if "No such file or directory" in stderr_text or "Unable to open input file" in stderr_text:
                     print("         Sugerencia: El archivo de entrada no se encontró, no pudo ser abierto por HandBrakeCLI, o la ruta es incorrecta.")
-                if "encoder initialization failed" in result.stderr or "No matching encoder" in result.stderr:
+                if "encoder initialization failed" in stderr_text or "No matching encoder" in stderr_text:
                     print(f"         Sugerencia: Problema con el codificador '{encoder_option}'. Revisa si HandBrakeCLI soporta este codificador en tu sistema (especialmente para GPU) o si los drivers de la GPU están bien configurados.")
-                if "Invalid argument" in result.stderr or "Unknown option" in result.stderr:
+                if "Invalid argument" in stderr_text or "Unknown option" in stderr_text:
                     print("         Sugerencia: Revisa los parámetros del comando de HandBrakeCLI. Puede haber una opción incorrecta o incompatible.")
             else:
                 print("         No hay salida de error detallada de HandBrakeCLI (STDERR está vacío).")
@@ -261,11 +486,324 @@ def convert_video_to_hevc(input_path, output_path, crf, preset, enable_gpu, gpu_
         _debug_print(f"PATH actual: {os.environ.get('PATH')}")
         return False
     except Exception as e:
+        if process and process.poll() is None:
+            process.kill()
+            process.wait()
         print(f"\n     ❌ Error inesperado al convertir video {os.path.basename(input_path)}: {e}")
         if "WinError 740" in str(e) or "requiere elevacion" in str(e):
             print("         Este error indica que HandBrakeCLI necesita permisos de administrador. Intenta ejecutar el script como administrador.")
         return False
 
+# Lee una salida de HandBrakeCLI por bloques, separando líneas por '\r' o '\n' (el progreso usa '\r')
+def _iter_stream_lines(stream):
+    # Decodificador incremental con la codificación del sistema (como text=True): un carácter
+    # multibyte partido entre dos bloques no se pierde
+    decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))(errors="replace")
+    pending = ""
+    while True:
+        chunk = stream.read1(4096) if hasattr(stream, "read1") else stream.read(4096)
+        if not chunk:
+            pending += decoder.decode(b"", final=True)
+            break
+        pending += decoder.decode(chunk)
+        lines = re.split(r"[\r\n]", pending)
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line.strip()
+    if pending.strip():
+        yield pending.strip()
+
+def _read_stream_tail(stream, tail):
+    for line in _iter_stream_lines(stream):
+        tail.append(line)
+
+def _read_handbrake_progress(stream, tail, input_path):
+    last_logged_decile = -1
+    for line in _iter_stream_lines(stream):
+        match = HANDBRAKE_PROGRESS_PATTERN.search(line)
+        if not match:
+            tail.append(line)
+            continue
+        task, task_count, percent = int(match.group(1)), int(match.group(2)), float(match.group(3))
+        fraction = min(1.0, ((task - 1) + percent / 100) / max(1, task_count))
+        fps = float(match.group(4)) if match.group(4) else None
+        eta_seconds = None
+        if match.group(6):
+            eta_seconds = int(match.group(6)) * 3600 + int(match.group(7)) * 60 + int(match.group(8))
+        with video_progress_lock:
+            video_progress[input_path] = {"fraction": fraction, "fps": fps, "eta": eta_seconds}
+        decile = int(fraction * 10)
+        if decile != last_logged_decile:
+            last_logged_decile = decile
+            _debug_print(f"{os.path.basename(input_path)}: {fraction * 100:.1f}% ({fps or 0:.1f} fps, ETA {format_time_short(eta_seconds)})")
+
+# Recorre las cajas ISO BMFF (MP4/MOV/HEIF) entre start y end. Devuelve (tipo, inicio_datos, fin_caja).
+def iter_bmff_boxes(f, start, end):
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError(f"cabecera de caja truncada en el byte {position}")
+        box_size = int.from_bytes(header[0:4], "big")
+        box_type = header[4:8].decode("latin-1")
+        data_start = position + 8
+        if box_size == 1:
+            large_size = f.read(8)
+            if len(large_size) < 8:
+                raise ValueError(f"cabecera de caja '{box_type}' truncada")
+            box_size = int.from_bytes(large_size, "big")
+            data_start += 8
+        elif box_size == 0:
+            box_size = end - position
+        if box_size < data_start - position:
+            raise ValueError(f"tamaño de caja '{box_type}' no válido ({box_size})")
+        box_end = position + box_size
+        if box_end > end:
+            raise ValueError(f"caja '{box_type}' truncada ({box_end - end} bytes que faltan)")
+        yield box_type, data_start, box_end
+        position = box_end
+    if position != end:
+        raise ValueError(f"{end - position} bytes sobrantes al final de la estructura")
+
+# Lectura estructural barata: solo cabeceras de cajas, sin decodificar imagen ni video
+def read_bmff_structure(path):
+    structure = {"boxes": [], "duration": None, "dimensions": [], "tracks": {}}
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        for box_type, data_start, box_end in iter_bmff_boxes(f, 0, file_size):
+            structure["boxes"].append(box_type)
+            if box_type == "moov":
+                _read_bmff_moov(f, data_start, box_end, structure)
+            elif box_type == "meta":
+                # 'meta' es una FullBox: 4 bytes de versión/flags antes de las cajas hijas
+                _read_bmff_meta(f, data_start + 4, box_end, structure)
+    return structure
+
+def _read_bmff_moov(f, start, end, structure):
+    for box_type, data_start, box_end in iter_bmff_boxes(f, start, end):
+        if box_type == "mvhd":
+            f.seek(data_start)
+            version = f.read(1)[0]
+            if version == 1:
+                f.seek(data_start + 20)
+                timescale = int.from_bytes(f.read(4), "big")
+                duration = int.from_bytes(f.read(8), "big")
+            else:
+                f.seek(data_start + 12)
+                timescale = int.from_bytes(f.read(4), "big")
+                duration = int.from_bytes(f.read(4), "big")
+            if timescale:
+                structure["duration"] = duration / timescale
+        elif box_type == "trak":
+            _read_bmff_trak(f, data_start, box_end, structure)
+
+def _read_bmff_trak(f, start, end, structure):
+    handler_type = None
+    dimensions = None
+    for box_type, data_start, box_end in iter_bmff_boxes(f, start, end):
+        if box_type == "tkhd":
+            f.seek(data_start)
+            version = f.read(1)[0]
+            # Ancho y alto (16.16 en coma fija) son los últimos 8 bytes de tkhd
+            f.seek(data_start + (88 if version == 1 else 76))
+            width = int.from_bytes(f.read(4), "big") >> 16
+            height = int.from_bytes(f.read(4), "big") >> 16
+            dimensions = (width, height)
+        elif box_type == "mdia":
+            for child_type, child_start, _ in iter_bmff_boxes(f, data_start, box_end):
+                if child_type == "hdlr":
+                    f.seek(child_start + 8)
+                    handler_type = f.read(4).decode("latin-1")
+    if handler_type:
+        structure["tracks"][handler_type] = structure["tracks"].get(handler_type, 0) + 1
+    if handler_type == "vide" and dimensions:
+        structure["dimensions"].append(dimensions)
+
+def _read_bmff_meta(f, start, end, structure):
+    properties = []
+    associations = {}
+    primary_item_id = None
+    for box_type, data_start, box_end in iter_bmff_boxes(f, start, end):
+        if box_type == "pitm":
+            f.seek(data_start)
+            version = f.read(4)[0]
+            primary_item_id = int.from_bytes(f.read(4 if version else 2), "big")
+        elif box_type == "iprp":
+            for child_type, child_start, child_end in iter_bmff_boxes(f, data_start, box_end):
+                if child_type == "ipco":
+                    for prop_type, prop_start, _ in iter_bmff_boxes(f, child_start, child_end):
+                        prop_value = None
+                        if prop_type == "ispe":
+                            f.seek(prop_start + 4)
+                            width = int.from_bytes(f.read(4), "big")
+                            height = int.from_bytes(f.read(4), "big")
+                            structure["dimensions"].append((width, height))
+                            prop_value = (width, height)
+                        elif prop_type == "clap":
+                            # Recorte (ancho y alto como fracciones N/D): libheif rellena a tamaño par y lo recorta aquí
+                            f.seek(prop_start)
+                            width_n, width_d, height_n, height_d = (int.from_bytes(f.read(4), "big") for _ in range(4))
+                            if width_d and height_d:
+                                prop_value = (round(width_n / width_d), round(height_n / height_d))
+                        properties.append((prop_type, prop_value))
+                elif child_type == "ipma":
+                    associations.update(_read_bmff_ipma(f, child_start, child_end))
+
+    # Tamaño visible de la imagen principal: su 'ispe' recortado por su 'clap' si lo tiene
+    primary_dimensions = None
+    for index in associations.get(primary_item_id, []):
+        if 0 <= index < len(properties):
+            prop_type, prop_value = properties[index]
+            if prop_type == "ispe" and prop_value and primary_dimensions is None:
+                primary_dimensions = prop_value
+            elif prop_type == "clap" and prop_value:
+                primary_dimensions = prop_value
+    if primary_dimensions:
+        structure["primary_dimensions"] = primary_dimensions
+
+# Asociaciones item -> índices (desde 0) de propiedades en 'ipco'
+def _read_bmff_ipma(f, start, end):
+    associations = {}
+    f.seek(start)
+    version_flags = int.from_bytes(f.read(4), "big")
+    version, flags = version_flags >> 24, version_flags & 0xFFFFFF
+    entry_count = int.from_bytes(f.read(4), "big")
+    for _ in range(entry_count):
+        if f.tell() >= end:
+            raise ValueError("caja 'ipma' truncada")
+        item_id = int.from_bytes(f.read(4 if version else 2), "big")
+        association_count = f.read(1)[0]
+        indices = []
+        for _ in range(association_count):
+            if flags & 1:
+                index = int.from_bytes(f.read(2), "big") & 0x7FFF
+            else:
+                index = f.read(1)[0] & 0x7F
+            if index:
+                indices.append(index - 1)
+        associations[item_id] = indices
+    return associations
+
+def _same_dimensions(a, b, slack=0):
+    def close(x, y):
+        return abs(x[0] - y[0]) <= slack and abs(x[1] - y[1]) <= slack
+    return close(a, b) or close(a, (b[1], b[0]))
+
+# El preset de HandBrakeCLI puede reducir, recortar las franjas negras (p. ej. 1920x1080 -> 1920x800) y rotar
+# el video, así que no se exige igualdad ni la misma proporción: la salida debe caber en el original
+# y no ser anormalmente pequeña
+VIDEO_MIN_AREA_FRACTION = 0.02
+VIDEO_MIN_SIDE = 16
+
+def _video_dimensions_compatible(output_dimensions, source_dimensions):
+    output_long, output_short = max(output_dimensions), min(output_dimensions)
+    source_long, source_short = max(source_dimensions), min(source_dimensions)
+    if not source_short:
+        return True
+    # +2 px por el redondeo a múltiplos pares del codificador
+    if output_long > source_long + 2 or output_short > source_short + 2:
+        return False
+    if output_short < min(VIDEO_MIN_SIDE, source_short):
+        return False
+    return output_long * output_short >= source_long * source_short * VIDEO_MIN_AREA_FRACTION
+
+# Comprueba el archivo convertido antes de borrar el original. Devuelve (correcto, motivo).
+def verify_converted_output(input_path, output_path, is_video, sampled_decode=False):
+    try:
+        output_structure = read_bmff_structure(output_path)
+    except Exception as e:
+        return False, f"estructura no válida: {e}"
+
+    if not output_structure["boxes"] or output_structure["boxes"][0] != "ftyp":
+        return False, "falta la caja 'ftyp' al inicio"
+
+    if is_video:
+        if "moov" not in output_structure["boxes"] or "mdat" not in output_structure["boxes"]:
+            return False, "faltan las cajas 'moov' o 'mdat'"
+        if not output_structure["duration"]:
+            return False, "duración nula"
+        if not output_structure["dimensions"] or not all(w > 0 and h > 0 for w, h in output_structure["dimensions"]):
+            return False, "sin pista de video con dimensiones válidas"
+
+        # MP4/MOV de origen: se compara duración, dimensiones y número de pistas. Otros contenedores solo se validan en destino.
+        if os.path.splitext(input_path)[1].lower() in ('.mp4', '.mov'):
+            try:
+                source_structure = read_bmff_structure(input_path)
+            except Exception as e:
+                source_structure = None
+                _debug_print(f"No se pudo leer la estructura de {os.path.basename(input_path)} para comparar: {e}")
+            if source_structure and source_structure["duration"]:
+                difference = abs(source_structure["duration"] - output_structure["duration"])
+                if difference > max(1.0, source_structure["duration"] * 0.02):
+                    return False, f"duración distinta ({output_structure['duration']:.1f}s frente a {source_structure['duration']:.1f}s)"
+            if source_structure:
+                # HandBrakeCLI codifica una sola pista de video y conserva todas las de audio
+                if source_structure["tracks"].get("vide", 0) and output_structure["tracks"].get("vide", 0) != 1:
+                    return False, f"pistas de video: {output_structure['tracks'].get('vide', 0)} (esperada 1)"
+                if output_structure["tracks"].get("soun", 0) != source_structure["tracks"].get("soun", 0):
+                    return False, f"pistas de audio: {output_structure['tracks'].get('soun', 0)} frente a {source_structure['tracks'].get('soun', 0)} en el original"
+            if source_structure and source_structure["dimensions"]:
+                source_dimensions = max(source_structure["dimensions"], key=lambda d: d[0] * d[1])
+                output_dimensions = output_structure["dimensions"][0]
+                if not _video_dimensions_compatible(output_dimensions, source_dimensions):
+                    return False, f"dimensiones {output_dimensions[0]}x{output_dimensions[1]} no compatibles con {source_dimensions[0]}x{source_dimensions[1]} en el original"
+    else:
+        if "meta" not in output_structure["boxes"]:
+            return False, "falta la caja 'meta'"
+        if "mdat" not in output_structure["boxes"]:
+            return False, "falta la caja 'mdat'"
+        if not output_structure["dimensions"]:
+            return False, "sin dimensiones (caja 'ispe')"
+        try:
+            with Image.open(input_path) as source_img:
+                source_dimensions = source_img.size
+        except Exception as e:
+            return False, f"no se pudieron leer las dimensiones del original: {e}"
+        output_dimensions = output_structure.get("primary_dimensions")
+        dimension_slack = 0
+        if not output_dimensions:
+            # Sin imagen principal identificable: la de mayor tamaño (las demás son miniaturas o teselas),
+            # con margen por el relleno a tamaño par de HEVC 4:2:0
+            output_dimensions = max(output_structure["dimensions"], key=lambda d: d[0] * d[1])
+            dimension_slack = 2
+        if not _same_dimensions(output_dimensions, source_dimensions, dimension_slack):
+            return False, f"dimensiones {output_dimensions[0]}x{output_dimensions[1]} frente a {source_dimensions[0]}x{source_dimensions[1]} en el original"
+
+    if sampled_decode:
+        return verify_sampled_decode(output_path, is_video, output_structure["duration"])
+    return True, ""
+
+# Comprobación opcional más cara: decodifica la imagen o unos pocos fotogramas del video
+def verify_sampled_decode(output_path, is_video, duration=None):
+    if not is_video:
+        try:
+            with Image.open(output_path) as img:
+                img.load()
+            return True, ""
+        except Exception as e:
+            return False, f"la imagen no se puede decodificar: {e}"
+
+    # process_gallery desactiva esta comprobación al arrancar si no hay ffmpeg; nunca se da por buena sin decodificar
+    if not FFMPEG_PATH:
+        return False, "ffmpeg no disponible para la decodificación de muestra"
+
+    creation_flags = 0
+    if platform.system() == "Windows":
+        creation_flags = subprocess.CREATE_NO_WINDOW
+
+    for fraction in (0.1, 0.5, 0.9):
+        seek_seconds = f"{(duration or 0) * fraction:.2f}"
+        command = [FFMPEG_PATH, "-v", "error", "-ss", seek_seconds, "-i", output_path, "-frames:v", "1", "-f", "null", "-"]
+        try:
+            result = subprocess.run(command, capture_output=True, text=True, check=False, creationflags=creation_flags)
+        except Exception as e:
+            return False, f"no se pudo ejecutar ffmpeg para la decodificación de muestra: {e}"
+        if result.returncode != 0 or result.stderr.strip():
+            return False, f"error al decodificar en {seek_seconds}s: {result.stderr.strip()[:200]}"
+    return True, ""
+
 def copy_metadata_with_exiftool(source_path, target_path, max_retries, retry_delay, new_modification_date_timestamp=None):
     _debug_print(f"Intentando copiar metadatos de {os.path.basename(source_path)} a {os.path.basename(target_path)}")
 
@@ -322,7 +860,54 @@ def copy_metadata_with_exiftool(source_path, target_path, max_retries, retry_del
             return False
     return False
 
-def process_file_task(input_path, output_directory, heic_quality, hevc_crf, hevc_preset, enable_gpu_accel, gpu_encoder_name, max_retries, retry_delay):
+def is_output_up_to_date(input_path, output_path):
+    return os.path.exists(output_path) and os.path.getmtime(output_path) > os.path.getmtime(input_path)
+
+# Misma comprobación que hace process_file_task para saltar archivos ya convertidos,
+# usada para no precargar en la carpeta temporal lo que se va a saltar
+def needs_conversion(input_path, output_directory):
+    relative_path = os.path.relpath(input_path, SOURCE_DIRECTORY)
+    name, ext = os.path.splitext(os.path.basename(input_path))
+    ext_lower = ext.lower()
+    if ext_lower in IMAGE_EXTENSIONS:
+        output_filename = f"{name}.heic"
+    elif ext_lower in VIDEO_EXTENSIONS:
+        output_filename = f"{name}.mp4"
+    else:
+        return False
+    output_path = os.path.join(output_directory, os.path.dirname(relative_path), output_filename)
+    if not is_output_up_to_date(input_path, output_path):
+        return True
+    # Las fotos de ejemplo del modo desarrollador se procesan siempre
+    return DEVELOPER_MODE and ext_lower in IMAGE_EXTENSIONS and is_path_inside(input_path, os.path.join(BASE_DIRECTORY, "extra", "archivos-ejemplo"))
+
+def _get_work_paths(stager, input_path, output_path, output_filename):
+    if not stager:
+        return input_path, output_path
+    local_output_path = stager.local_output_path(input_path, output_filename)
+    if not local_output_path:
+        return input_path, output_path
+    return stager.fetch(input_path), local_output_path
+
+# Solo fechas del sistema de archivos (no reescribe el contenido): tras copiar desde la carpeta
+# temporal, la fecha de creación del destino es la de la copia
+def set_file_dates_with_exiftool(target_path, timestamp):
+    exiftool_path = check_binary_exists_in_path_or_dir("exiftool", EXTERNAL_TOOLS_DIRECTORY)
+    exiftool_cmd = exiftool_path if isinstance(exiftool_path, str) else "exiftool"
+    exiftool_date_format = datetime.datetime.fromtimestamp(timestamp).strftime("%Y:%m:%d %H:%M:%S")
+    command = [exiftool_cmd, "-overwrite_original", "-FileModifyDate=" + exiftool_date_format, "-FileCreateDate=" + exiftool_date_format, target_path]
+    _debug_print(f"Comando ExifTool (fechas): {' '.join(command)}")
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, check=False)
+    except Exception as e:
+        print(f"\n     ⚠️ No se pudieron establecer las fechas de {os.path.basename(target_path)}: {e}")
+        return False
+    if result.returncode != 0:
+        print(f"\n     ⚠️ No se pudieron establecer las fechas de {os.path.basename(target_path)}: {result.stderr.strip()}")
+        return False
+    return True
+
+def process_file_task(input_path, output_directory, heic_quality, hevc_crf, hevc_preset, enable_gpu_accel, gpu_encoder_name, max_retries, retry_delay, stager=None):
     relative_path = os.path.relpath(input_path, SOURCE_DIRECTORY)
     output_subdir = os.path.join(output_directory, os.path.dirname(relative_path))
     os.makedirs(output_subdir, exist_ok=True)
@@ -334,16 +919,25 @@ def process_file_task(input_path, output_directory, heic_quality, hevc_crf, hevc
     final_processing_successful = False
     original_exif_data = None
     output_path = None
+    # Con carpeta temporal se codifica sobre copias locales y la salida se copia al destino al final
+    work_input_path = input_path
+    work_output_path = None
+    new_mod_date_timestamp = None
     original_size = 0 
+    extra_outputs_written = []
+    extra_output_paths = []
+    if EXTRA_OUTPUT_SPECS and ext_lower in IMAGE_EXTENSIONS + VIDEO_EXTENSIONS:
+        extra_output_paths = get_extra_output_paths(relative_path, name)
+    missing_extra_outputs = [(spec, extra_path) for spec, extra_path in extra_output_paths if not os.path.exists(extra_path)]
 
     try:
         original_size = os.path.getsize(input_path)
     except FileNotFoundError:
         print(f"\n     ❌ Archivo no encontrado al intentar obtener el tamaño: {os.path.basename(input_path)}")
-        return "failed_not_found", os.path.basename(input_path), original_size
+        return "failed_not_found", os.path.basename(input_path), original_size, extra_outputs_written
     except Exception as e:
         print(f"\n     ❌ Error al obtener el tamaño del archivo {os.path.basename(input_path)}: {e}")
-        return "failed_size_retrieval", os.path.basename(input_path), original_size
+        return "failed_size_retrieval", os.path.basename(input_path), original_size, extra_outputs_written
 
     if ext_lower in IMAGE_EXTENSIONS:
         output_filename = f"{name}.heic"
@@ -351,34 +945,54 @@ def process_file_task(input_path, output_directory, heic_quality, hevc_crf, hevc
 
         is_example_photo = DEVELOPER_MODE and os.path.commonpath([input_path, os.path.join(BASE_DIRECTORY, "extra", "archivos-ejemplo")]) == os.path.join(BASE_DIRECTORY, "extra", "archivos-ejemplo")
 
-        if os.path.exists(output_path) and os.path.getmtime(output_path) > os.path.getmtime(input_path):
+        if is_output_up_to_date(input_path, output_path):
             if not is_example_photo:
-                return "skipped_already_processed", os.path.basename(input_path), original_size
+                # Ya convertida: solo genera las salidas extra que falten
+                if missing_extra_outputs:
+                    try:
+                        with Image.open(input_path) as img:
+                            extra_outputs_written = save_extra_outputs(img, missing_extra_outputs, img.info.get('exif'))
+                    except Exception as e:
+                        print(f"\n     ⚠️ No se pudieron generar las salidas extra de {os.path.basename(input_path)}: {e}")
+                return "skipped_already_processed", os.path.basename(input_path), original_size, extra_outputs_written
         # Si es foto de ejemplo en modo desarrollador, siempre procesa
+        work_input_path, work_output_path = _get_work_paths(stager, input_path, output_path, output_filename)
         try:
-            img = Image.open(input_path)
+            img = Image.open(work_input_path)
             if 'exif' in img.info:
                 original_exif_data = img.info['exif']
             img.close()
         except Exception as e: 
             _debug_print(f"No se pudo leer EXIF de {os.path.basename(input_path)}: {e}")
 
-        conversion_successful_tool = convert_image_to_heic(input_path, output_path, heic_quality, original_exif_data)
+        conversion_successful_tool, extra_outputs_written = convert_image_to_heic(work_input_path, work_output_path, heic_quality, original_exif_data, extra_output_paths)
 
     elif ext_lower in VIDEO_EXTENSIONS:
         output_filename = f"{name}.mp4" 
         output_path = os.path.join(output_subdir, output_filename)
 
-        if os.path.exists(output_path) and os.path.getmtime(output_path) > os.path.getmtime(input_path):
-            return "skipped_already_processed", os.path.basename(input_path), original_size
+        if is_output_up_to_date(input_path, output_path):
+            if missing_extra_outputs:
+                poster = extract_video_poster_frame(input_path)
+                if poster:
+                    extra_outputs_written = save_extra_outputs(poster, missing_extra_outputs)
+                    poster.close()
+            return "skipped_already_processed", os.path.basename(input_path), original_size, extra_outputs_written
+
+        work_input_path, work_output_path = _get_work_paths(stager, input_path, output_path, output_filename)
+        conversion_successful_tool = convert_video_to_hevc(work_input_path, work_output_path, hevc_crf, hevc_preset, enable_gpu_accel, gpu_encoder_name, progress_key=input_path)
 
-        conversion_successful_tool = convert_video_to_hevc(input_path, output_path, hevc_crf, hevc_preset, enable_gpu_accel, gpu_encoder_name)
+        if conversion_successful_tool and extra_output_paths:
+            poster = extract_video_poster_frame(work_input_path)
+            if poster:
+                extra_outputs_written = save_extra_outputs(poster, extra_output_paths)
+                poster.close()
 
     else:
-        return "skipped_unsupported", os.path.basename(input_path), original_size
+        return "skipped_unsupported", os.path.basename(input_path), original_size, extra_outputs_written
 
-    if conversion_successful_tool and output_path and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-        _debug_print(f"Archivo de salida {os.path.basename(output_path)} existe y no está vacío.")
+    if conversion_successful_tool and work_output_path and os.path.exists(work_output_path) and os.path.getsize(work_output_path) > 0:
+        _debug_print(f"Archivo de salida {os.path.basename(work_output_path)} existe y no está vacío.")
 
         new_mod_date_timestamp = None
         if ext_lower in VIDEO_EXTENSIONS:
@@ -396,29 +1010,29 @@ def process_file_task(input_path, output_directory, heic_quality, hevc_crf, hevc
             else:
                 _debug_print("No se detectó el formato de fecha 'yyyymmdd' en el nombre del video. Dejando la fecha de modificación por defecto.")
 
-        copy_metadata_successful = copy_metadata_with_exiftool(input_path, output_path, max_retries, retry_delay, new_mod_date_timestamp)
+        copy_metadata_successful = copy_metadata_with_exiftool(work_input_path, work_output_path, max_retries, retry_delay, new_mod_date_timestamp)
         if not copy_metadata_successful:
             print(f"\n     ⚠️ Advertencia: No se pudieron copiar todos los metadatos para {os.path.basename(input_path)}. El archivo convertido se mantiene.")
 
         try:
             if new_mod_date_timestamp:
-                os.utime(output_path, (new_mod_date_timestamp, new_mod_date_timestamp))
-                _debug_print(f"Fecha de modificación del sistema establecida desde el nombre para {os.path.basename(output_path)}.")
+                os.utime(work_output_path, (new_mod_date_timestamp, new_mod_date_timestamp))
+                _debug_print(f"Fecha de modificación del sistema establecida desde el nombre para {os.path.basename(work_output_path)}.")
             else:
                 original_stat = os.stat(input_path)
                 file_ready_for_utime = False
                 for attempt in range(max_retries):
-                    if output_path and os.path.exists(output_path) and os.path.getsize(output_path) > 0: 
-                        os.utime(output_path, (original_stat.st_atime, original_stat.st_mtime))
+                    if work_output_path and os.path.exists(work_output_path) and os.path.getsize(work_output_path) > 0: 
+                        os.utime(work_output_path, (original_stat.st_atime, original_stat.st_mtime))
                         file_ready_for_utime = True
-                        _debug_print(f"Fecha de modificación copiada para {os.path.basename(output_path)}.")
+                        _debug_print(f"Fecha de modificación copiada para {os.path.basename(work_output_path)}.")
                         break
                     else:
-                        _debug_print(f"Archivo de salida {os.path.basename(output_path)} no listo (intento {attempt + 1}/{max_retries}), reintentando utime...")
+                        _debug_print(f"Archivo de salida {os.path.basename(work_output_path)} no listo (intento {attempt + 1}/{max_retries}), reintentando utime...")
                         time.sleep(retry_delay)
 
                 if not file_ready_for_utime:
-                    print(f"\n     ⚠️ Advertencia: Archivo de salida no encontrado o vacío en {output_path} después de reintentos para copiar fecha. No se pudo establecer la fecha de modificación.")
+                    print(f"\n     ⚠️ Advertencia: Archivo de salida no encontrado o vacío en {work_output_path} después de reintentos para copiar fecha. No se pudo establecer la fecha de modificación.")
 
             final_processing_successful = True
 
@@ -430,33 +1044,214 @@ def process_file_task(input_path, output_directory, heic_quality, hevc_crf, hevc
         print(f"\n     ❌ Conversión fallida para {os.path.basename(input_path)}: La herramienta de conversión reportó un fallo o el archivo de salida no fue creado/está vacío.")
         final_processing_successful = False
 
+    if final_processing_successful and VERIFY_OUTPUTS:
+        # Se comprueba el archivo final (ExifTool lo reescribe) antes de tocar el original
+        verification_ok, verification_reason = verify_converted_output(work_input_path, work_output_path, ext_lower in VIDEO_EXTENSIONS, VERIFY_SAMPLED_DECODE)
+        if verification_ok:
+            _debug_print(f"Verificación correcta de {os.path.basename(output_path)}.")
+        else:
+            print(f"\n     ❌ Verificación fallida para {os.path.basename(output_path)}: {verification_reason}. Se conserva el original.")
+            try:
+                # Se elimina la salida defectuosa para que la próxima ejecución vuelva a convertir
+                os.remove(work_output_path)
+            except Exception as e:
+                print(f"\n     ⚠️ No se pudo eliminar la salida defectuosa {os.path.basename(output_path)}: {e}")
+            return "failed_verification", os.path.basename(input_path), original_size, extra_outputs_written
+
+    if final_processing_successful and work_output_path != output_path:
+        if not stager.store_output(work_output_path, output_path):
+            return "failed_copy_back", os.path.basename(input_path), original_size, extra_outputs_written
+        # La copia no conserva la fecha de creación: se vuelve a fijar la fecha del nombre sobre el destino
+        if new_mod_date_timestamp:
+            set_file_dates_with_exiftool(output_path, new_mod_date_timestamp)
+            try:
+                os.utime(output_path, (new_mod_date_timestamp, new_mod_date_timestamp))
+            except Exception as e:
+                print(f"\n     ⚠️ No se pudo establecer la fecha de modificación de {os.path.basename(output_path)}: {e}")
+
     if final_processing_successful:
         try:
             # No borrar fotos de ejemplo si está activado el modo desarrollador
             if DEVELOPER_MODE and os.path.commonpath([input_path, os.path.join(BASE_DIRECTORY, "extra", "archivos-ejemplo")]) == os.path.join(BASE_DIRECTORY, "extra", "archivos-ejemplo"):
                 _debug_print(f"Modo desarrollador activo: no se elimina {os.path.basename(input_path)} (foto de ejemplo).")
-                return "processed", os.path.basename(input_path), original_size
+                return "processed", os.path.basename(input_path), original_size, extra_outputs_written
             os.remove(input_path)
             _debug_print(f"Archivo original {os.path.basename(input_path)} eliminado tras conversion exitosa.")
-            return "processed", os.path.basename(input_path), original_size
+            return "processed", os.path.basename(input_path), original_size, extra_outputs_written
         except Exception as e:
             print(f"\n     ❌ Error al eliminar el archivo original {os.path.basename(input_path)}: {e}")
-            return "failed_delete_original", os.path.basename(input_path), original_size
+            return "failed_delete_original", os.path.basename(input_path), original_size, extra_outputs_written
     else:
-        return "failed_conversion", os.path.basename(input_path), original_size
+        return "failed_conversion", os.path.basename(input_path), original_size, extra_outputs_written
+
+# Limita el ancho de banda compartido entre hilos (MB/s); 0 desactiva el límite
+class BandwidthLimiter:
+    def __init__(self, megabytes_per_second):
+        self.bytes_per_second = megabytes_per_second * 1024 * 1024
+        self.lock = threading.Lock()
+        self.next_free_time = time.monotonic()
+    def consume(self, num_bytes):
+        if not self.bytes_per_second:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.next_free_time = max(now, self.next_free_time) + num_bytes / self.bytes_per_second
+            wait_seconds = self.next_free_time - now
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+def copy_file_throttled(source_path, target_path, limiter, chunk_size=1024 * 1024):
+    with open(source_path, "rb") as source, open(target_path, "wb") as target:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            target.write(chunk)
+            limiter.consume(len(chunk))
+    shutil.copystat(source_path, target_path)
+
+# Copia local de trabajo: precarga las entradas siguientes en orden, se codifica en local
+# y las salidas se devuelven al destino con concurrencia y ancho de banda limitados
+class ScratchStager:
+    def __init__(self, scratch_directory, read_ahead, read_concurrency, write_concurrency, read_limit_mbps, write_limit_mbps):
+        os.makedirs(scratch_directory, exist_ok=True)
+        self.run_directory = tempfile.mkdtemp(prefix="neu-", dir=scratch_directory)
+        self.read_limiter = BandwidthLimiter(read_limit_mbps)
+        self.write_limiter = BandwidthLimiter(write_limit_mbps)
+        # Máximo de entradas copiadas en local a la vez (en proceso o esperando a un hilo)
+        self.read_ahead_slots = threading.Semaphore(read_ahead)
+        self.write_slots = threading.Semaphore(write_concurrency)
+        self.prefetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=read_concurrency)
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.entry_counter = 0
+
+    def prefetch(self, input_paths):
+        for input_path in input_paths:
+            with self.lock:
+                self.entry_counter += 1
+                entry = {"directory": os.path.join(self.run_directory, str(self.entry_counter)), "released": False, "finished": False, "holds_slot": False}
+                self.entries[input_path] = entry
+            entry["future"] = self.prefetch_executor.submit(self._prefetch_one, input_path, entry)
+
+    def _prefetch_one(self, input_path, entry):
+        self.read_ahead_slots.acquire()
+        with self.lock:
+            entry["holds_slot"] = True
+            if entry["released"]:
+                self._discard(entry)
+                return None
+        local_input_path = os.path.join(entry["directory"], "entrada", os.path.basename(input_path))
+        try:
+            os.makedirs(os.path.dirname(local_input_path), exist_ok=True)
+            copy_file_throttled(input_path, local_input_path, self.read_limiter)
+            _debug_print(f"Precargado en local: {os.path.basename(input_path)}")
+        except Exception as e:
+            _debug_print(f"No se pudo precargar {os.path.basename(input_path)} ({e}). Se leerá desde el origen.")
+            local_input_path = None
+        with self.lock:
+            entry["finished"] = True
+            if entry["released"]:
+                self._discard(entry)
+                return None
+        return local_input_path
+
+    # Ruta local de la entrada (espera a la precarga). Si no se pudo precargar, la ruta original.
+    def fetch(self, input_path):
+        with self.lock:
+            entry = self.entries.get(input_path)
+        if not entry:
+            return input_path
+        return entry["future"].result() or input_path
+
+    def local_output_path(self, input_path, output_filename):
+        with self.lock:
+            entry = self.entries.get(input_path)
+        if not entry:
+            return None
+        local_output_directory = os.path.join(entry["directory"], "salida")
+        os.makedirs(local_output_directory, exist_ok=True)
+        return os.path.join(local_output_directory, output_filename)
+
+    def store_output(self, local_output_path, output_path):
+        partial_output_path = output_path + ".parcial"
+        with self.write_slots:
+            try:
+                copy_file_throttled(local_output_path, partial_output_path, self.write_limiter)
+                if os.path.getsize(partial_output_path) != os.path.getsize(local_output_path):
+                    raise IOError("el tamaño copiado no coincide")
+                if VERIFY_OUTPUTS:
+                    # Se verifica la copia que se queda en el destino, no solo la local (solo lee cabeceras)
+                    read_bmff_structure(partial_output_path)
+                os.replace(partial_output_path, output_path)
+                return True
+            except Exception as e:
+                print(f"\n     ❌ Error al copiar {os.path.basename(output_path)} al destino: {e}")
+                if os.path.exists(partial_output_path):
+                    os.remove(partial_output_path)
+                return False
+
+    # Libera la copia local de un archivo (éxito, fallo u omitido)
+    def release(self, input_path):
+        with self.lock:
+            entry = self.entries.pop(input_path, None)
+            if not entry:
+                return
+            entry["released"] = True
+            if entry["future"].cancel():
+                return
+            # Si la precarga sigue en curso, la propia tarea limpia al terminar
+            if not entry["finished"]:
+                return
+        self._discard(entry)
+
+    def _discard(self, entry):
+        shutil.rmtree(entry["directory"], ignore_errors=True)
+        if entry["holds_slot"]:
+            entry["holds_slot"] = False
+            self.read_ahead_slots.release()
+
+    def close(self):
+        with self.lock:
+            for entry in self.entries.values():
+                entry["released"] = True
+                entry["future"].cancel()
+            self.entries.clear()
+        self.prefetch_executor.shutdown(wait=True)
+        shutil.rmtree(self.run_directory, ignore_errors=True)
+
+def process_file_task_staged(stager, input_path, *task_args):
+    try:
+        return process_file_task(input_path, *task_args, stager=stager)
+    finally:
+        stager.release(input_path)
 
-def print_progress(total, processed, skipped_processed, skipped_unsupported, failed, phase_name, first_progress=False):
+def print_progress(total, processed, skipped_processed, skipped_unsupported, failed, phase_name, first_progress=False, weighted_fraction=None, eta_seconds=None, detail="", log_to_file=True):
     completed = processed + skipped_processed + skipped_unsupported + failed
-    percentage = (completed / total) * 100 if total > 0 else 0
+    if weighted_fraction is not None:
+        # Progreso ponderado (por bytes) que incluye lo ya codificado de los archivos en curso
+        percentage = min(100.0, weighted_fraction * 100)
+    else:
+        percentage = (completed / total) * 100 if total > 0 else 0
     bar_length = 30
     filled_length = int(bar_length * percentage // 100)
     bar = '█' * filled_length + '░' * (bar_length - filled_length)
     progress_line = f"🖼️ {phase_name}: |{bar}| {percentage:.1f}% ({completed}/{total}) ⏳"
+    if eta_seconds is not None:
+        progress_line += f" ETA {format_time_short(eta_seconds)}"
+    if detail:
+        progress_line += f" | {detail}"
+    # Los refrescos intermedios solo van a la consola, no al archivo de log
+    stream = sys.stdout if log_to_file else original_stdout
     if first_progress:
         # Borra la línea anterior (Procesando Fotos/Videos)
-        sys.stdout.write('\r' + ' ' * 120 + '\r')
-    sys.stdout.write(progress_line + ' ' * 10 + '\r')
-    sys.stdout.flush()
+        stream.write('\r' + ' ' * 120 + '\r')
+    stream.write(progress_line + ' ' * 10 + '\r')
+    stream.flush()
+
+def get_live_video_progress():
+    with video_progress_lock:
+        return {path: dict(info) for path, info in video_progress.items()}
 
 def clear_progress_lines():
     sys.stdout.write('\r' + ' ' * 120 + '\r')
@@ -467,7 +1262,7 @@ def print_fotos_procesadas():
     clear_progress_lines()
     print("✅ Fotos procesadas")
 
-def print_final_dashboard_and_summary(total_original_folder_size, num_image_files, num_video_files, dashboard_line, final_output_size):
+def print_final_dashboard_and_summary(total_original_folder_size, num_image_files, num_video_files, dashboard_line, final_output_size, extra_outputs=None, verified_count=0, failed_verification_count=0):
     clear_console()
     print("="*60)
     print("🗂️  NEU (Necesito Espacio Urgente)")
@@ -482,6 +1277,30 @@ def print_final_dashboard_and_summary(total_original_folder_size, num_image_file
         print(f"🏆 Tamaño original: {get_human_readable_size(total_original_folder_size)} | Tamaño final: {get_human_readable_size(final_output_size)} | Espacio Ahorrado: {get_human_readable_size(ahorro)} ({porcentaje:.2f}%)")
     else:
         print("No se pudieron calcular las estadísticas de ahorro de espacio.")
+    if VERIFY_OUTPUTS:
+        verification_mode = "estructura + decodificación de muestra" if VERIFY_SAMPLED_DECODE else "estructura"
+        print(f"🔎 Verificación ({verification_mode}): {verified_count} correctas | {failed_verification_count} fallidas (originales conservados)")
+    if extra_outputs:
+        extra_size = sum(size for _, size in extra_outputs)
+        print(f"🖼️  Salidas extra generadas: {len(extra_outputs)} | Tamaño: {get_human_readable_size(extra_size)}")
+        for spec in EXTRA_OUTPUT_SPECS:
+            extension = EXTRA_OUTPUT_FORMATS[spec["formato"]]
+            spec_outputs = [size for path, size in extra_outputs if is_path_inside(path, spec["carpeta"]) and path.lower().endswith(extension)]
+            if spec_outputs:
+                print(f"     - {spec['formato']} {spec['tamano_max']}px en {spec['carpeta']}: {len(spec_outputs)} archivos ({get_human_readable_size(sum(spec_outputs))})")
+
+# Carpetas de salidas extra dentro de 'directory', sin repetidas ni anidadas (para no restar dos veces)
+def get_extra_directories_inside(directory):
+    extra_directories = []
+    for spec in EXTRA_OUTPUT_SPECS:
+        extra_directory = spec["carpeta"]
+        if not is_path_inside(extra_directory, directory):
+            continue
+        if any(is_path_inside(extra_directory, other) for other in extra_directories):
+            continue
+        extra_directories = [other for other in extra_directories if not is_path_inside(other, extra_directory)]
+        extra_directories.append(extra_directory)
+    return extra_directories
 
 def get_directory_size(path):
     total_size = 0
@@ -504,9 +1323,9 @@ def print_initial_stats(total_original_folder_size, num_image_files, num_video_f
     print("="*60)
 
 def process_gallery():
-    global log_file_handle
+    global log_file_handle, FFMPEG_PATH, VERIFY_SAMPLED_DECODE
     global original_stdout, original_stderr
-
+    stager = None
 
     try:
 
@@ -541,6 +1360,17 @@ def process_gallery():
             input("\nPresiona ENTER para salir...")
             return
 
+        # ffmpeg es opcional: fotogramas de las salidas extra de video y decodificación de muestra
+        if EXTRA_OUTPUT_SPECS or (VERIFY_OUTPUTS and VERIFY_SAMPLED_DECODE):
+            FFMPEG_PATH = check_binary_exists_in_path_or_dir("ffmpeg", os.path.join(BASE_DIRECTORY, "extra")) or None
+            if not FFMPEG_PATH:
+                if EXTRA_OUTPUT_SPECS:
+                    print("⚠️ No se encontró ffmpeg: los videos no tendrán salidas extra (miniaturas/previas).")
+                if VERIFY_OUTPUTS and VERIFY_SAMPLED_DECODE:
+                    print("⚠️ No se encontró ffmpeg: se desactiva la verificación por decodificación de muestra (solo se comprobará la estructura).")
+                    VERIFY_SAMPLED_DECODE = False
+                print(f"   Coloca 'ffmpeg.exe' en {os.path.join(BASE_DIRECTORY, 'extra')} o añádelo al PATH.")
+
         if not os.path.exists(SOURCE_DIRECTORY):
             print(f"Error: El directorio de origen no existe: {SOURCE_DIRECTORY}")
             os.environ["PATH"] = original_path
@@ -587,6 +1417,25 @@ def process_gallery():
         overall_skipped_already_processed_count = 0
         overall_skipped_unsupported_count = 0
         overall_failed_count = 0
+        overall_extra_outputs = []
+        overall_failed_verification_count = 0
+
+        task_function = process_file_task
+        if SCRATCH_DIRECTORY:
+            try:
+                stager = ScratchStager(
+                    SCRATCH_DIRECTORY,
+                    # Nunca menos que hilos de trabajo + hilos de precarga, para que ningún hilo espere indefinidamente
+                    max(MAX_WORKERS * SCRATCH_READ_AHEAD_PER_WORKER, MAX_WORKERS + SCRATCH_READ_CONCURRENCY),
+                    SCRATCH_READ_CONCURRENCY,
+                    SCRATCH_WRITE_CONCURRENCY,
+                    SCRATCH_READ_LIMIT_MBPS,
+                    SCRATCH_WRITE_LIMIT_MBPS
+                )
+                task_function = functools.partial(process_file_task_staged, stager)
+                _debug_print(f"Carpeta temporal activa: {stager.run_directory}")
+            except Exception as e:
+                print(f"⚠️ No se pudo usar la carpeta temporal '{SCRATCH_DIRECTORY}' ({e}). Se trabajará directamente sobre las carpetas de entrada y salida.")
 
         if total_images > 0:
             processed_count_img = 0
@@ -594,10 +1443,12 @@ def process_gallery():
             skipped_unsupported_count_img = 0
             failed_count_img = 0
             first_progress = True
+            if stager:
+                stager.prefetch([file_path for file_path, _ in image_files_to_process if needs_conversion(file_path, OUTPUT_DIRECTORY)])
             with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
                 future_to_file = {
                     executor.submit(
-                        process_file_task,
+                        task_function,
                         file_path,
                         OUTPUT_DIRECTORY,
                         HEIC_QUALITY,
@@ -614,7 +1465,8 @@ def process_gallery():
                 for future in concurrent.futures.as_completed(future_to_file):
                     file_path, original_size = future_to_file[future]
                     try:
-                        status, original_filename, _ = future.result() 
+                        status, original_filename, _, extra_outputs = future.result() 
+                        overall_extra_outputs.extend(extra_outputs)
                         if status == "processed":
                             processed_count_img += 1
                             overall_processed_count += 1
@@ -627,6 +1479,8 @@ def process_gallery():
                         elif status.startswith("failed"):
                             failed_count_img += 1
                             overall_failed_count += 1
+                            if status == "failed_verification":
+                                overall_failed_verification_count += 1
                     except Exception as exc:
                         print(f'\n     ❌ El archivo {os.path.basename(file_path)} generó una excepción inesperada: {exc}')
                         failed_count_img += 1
@@ -643,10 +1497,12 @@ def process_gallery():
             skipped_unsupported_count_vid = 0
             failed_count_vid = 0
             first_progress = True
+            if stager:
+                stager.prefetch([file_path for file_path, _ in video_files_to_process if needs_conversion(file_path, OUTPUT_DIRECTORY)])
             with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
                 future_to_file = {
                     executor.submit(
-                        process_file_task,
+                        task_function,
                         file_path,
                         OUTPUT_DIRECTORY,
                         HEIC_QUALITY,
@@ -660,28 +1516,56 @@ def process_gallery():
                     for file_path, original_size in video_files_to_process
                 }
 
-                for future in concurrent.futures.as_completed(future_to_file):
-                    file_path, original_size = future_to_file[future]
-                    try:
-                        status, original_filename, _ = future.result() 
-                        if status == "processed":
-                            processed_count_vid += 1
-                            overall_processed_count += 1
-                        elif status == "skipped_already_processed":
-                            skipped_processed_count_vid += 1
-                            overall_skipped_already_processed_count += 1
-                        elif status == "skipped_unsupported":
-                            skipped_unsupported_count_vid += 1
-                            overall_skipped_unsupported_count += 1
-                        elif status.startswith("failed"):
+                video_sizes = dict(video_files_to_process)
+                total_video_bytes = sum(video_sizes.values())
+                completed_video_bytes = 0
+                video_phase_start = time.time()
+                pending_futures = set(future_to_file)
+                # Se refresca periódicamente (no solo al terminar un video) con el progreso en vivo de HandBrakeCLI
+                while pending_futures:
+                    done_futures, pending_futures = concurrent.futures.wait(pending_futures, timeout=PROGRESS_REFRESH_SECONDS, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done_futures:
+                        file_path, original_size = future_to_file[future]
+                        try:
+                            status, original_filename, _, extra_outputs = future.result() 
+                            overall_extra_outputs.extend(extra_outputs)
+                            if status == "processed":
+                                processed_count_vid += 1
+                                overall_processed_count += 1
+                            elif status == "skipped_already_processed":
+                                skipped_processed_count_vid += 1
+                                overall_skipped_already_processed_count += 1
+                            elif status == "skipped_unsupported":
+                                skipped_unsupported_count_vid += 1
+                                overall_skipped_unsupported_count += 1
+                            elif status.startswith("failed"):
+                                failed_count_vid += 1
+                                overall_failed_count += 1
+                                if status == "failed_verification":
+                                    overall_failed_verification_count += 1
+                        except Exception as exc:
+                            print(f'\n     ❌ El archivo {os.path.basename(file_path)} generó una excepción inesperada: {exc}')
                             failed_count_vid += 1
                             overall_failed_count += 1
-                    except Exception as exc:
-                        print(f'\n     ❌ El archivo {os.path.basename(file_path)} generó una excepción inesperada: {exc}')
-                        failed_count_vid += 1
-                        overall_failed_count += 1
 
-                    print_progress(total_videos, processed_count_vid, skipped_processed_count_vid, skipped_unsupported_count_vid, failed_count_vid, "Videos", first_progress=first_progress)
+                        completed_video_bytes += original_size
+                        with video_progress_lock:
+                            video_progress.pop(file_path, None)
+
+                    live_progress = get_live_video_progress()
+                    weighted_fraction = None
+                    eta_seconds = None
+                    detail = ""
+                    if total_video_bytes > 0:
+                        in_progress_bytes = sum(video_sizes.get(path, 0) * info["fraction"] for path, info in live_progress.items())
+                        weighted_fraction = (completed_video_bytes + in_progress_bytes) / total_video_bytes
+                        if weighted_fraction > 0:
+                            elapsed = time.time() - video_phase_start
+                            eta_seconds = elapsed * (1 - weighted_fraction) / weighted_fraction
+                    if live_progress:
+                        live_fps = sum(info["fps"] or 0 for info in live_progress.values())
+                        detail = f"{len(live_progress)} en curso, {live_fps:.0f} fps"
+                    print_progress(total_videos, processed_count_vid, skipped_processed_count_vid, skipped_unsupported_count_vid, failed_count_vid, "Videos", first_progress=first_progress, weighted_fraction=weighted_fraction, eta_seconds=eta_seconds, detail=detail, log_to_file=bool(done_futures))
                     first_progress = False
             clear_progress_lines()
             print(f"--- 🎞️  Videos terminados. Completadas: {processed_count_vid}, Saltadas (ya procesadas): {skipped_processed_count_vid}, Errores: {failed_count_vid} ---")
@@ -694,12 +1578,18 @@ def process_gallery():
             print(f"--- Total de Archivos Ignorados: {total_unsupported} ---")
 
         final_output_size = get_directory_size(OUTPUT_DIRECTORY)
+        # Las salidas extra no cuentan como archivo comprimido aunque estén dentro de la carpeta de salida
+        for extra_directory in get_extra_directories_inside(OUTPUT_DIRECTORY):
+            final_output_size -= get_directory_size(extra_directory)
         print_final_dashboard_and_summary(
             total_original_folder_size,
             total_images,
             total_videos,
             dashboard_line,
-            final_output_size
+            final_output_size,
+            overall_extra_outputs,
+            overall_processed_count,
+            overall_failed_verification_count
         )
 
     except Exception as main_e:
@@ -707,6 +1597,9 @@ def process_gallery():
         print(f"Detalles del error: {main_e}")
         print(f"Por favor, revisa el archivo de registro '{LOG_FILENAME}' para más detalles.")
     finally:
+        # La carpeta temporal se limpia siempre, haya terminado bien o no
+        if stager:
+            stager.close()
         if log_file_handle:
             log_file_handle.close()
         sys.stdout = original_stdout 